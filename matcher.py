@@ -0,0 +1,64 @@
+"""客戶資料的前綴比對。
+
+本模組只依賴標準函式庫並附完整型別標註，可以直接匯入使用，
+也可以用 mypyc 編譯成 C 擴充模組，讓比對迴圈不經過直譯器：
+
+    mypyc matcher.py
+
+編譯產生的 .so / .pyd 檔與 matcher.py 放在同一目錄時，Python 會優先匯入編譯版本。
+"""
+from bisect import bisect_left
+from typing import Final
+
+# 快速排除時檢查的前綴長度
+SHORT_PREFIX_LENGTH: Final = 3
+# Unicode 最大的字元，作為前綴範圍查詢的上界
+PREFIX_UPPER_BOUND: Final = '\U0010ffff'
+
+
+class SortedPrefixIndex:
+    """將欄位值排序後保存，以二分搜尋取出具有某前綴的連續範圍。"""
+    keys: list[str]
+    row_indices: list[int]
+
+    def __init__(self, column: list[str]) -> None:
+        pairs = sorted((value, row_index) for row_index, value in enumerate(column) if value)
+        self.keys = [value for value, _ in pairs]
+        self.row_indices = [row_index for _, row_index in pairs]
+
+    def find(self, prefix: str) -> list[int]:
+        """返回所有以 prefix 開頭的值所在的列索引。"""
+        # 以 prefix 開頭的字串在排序後必定落在 [prefix, prefix + 最大字元) 之間
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + PREFIX_UPPER_BOUND, start)
+        return self.row_indices[start:end]
+
+
+def build_short_prefixes(column: list[str]) -> set[str]:
+    """返回欄位中所有值的前 1～SHORT_PREFIX_LENGTH 個字元。"""
+    prefixes: set[str] = set()
+    for value in column:
+        for n in range(1, min(len(value), SHORT_PREFIX_LENGTH) + 1):
+            prefixes.add(value[:n])
+    return prefixes
+
+
+def match_rows(queries: dict[str, str],
+               short_prefixes: dict[str, set[str]],
+               indexes: dict[str, SortedPrefixIndex]) -> list[int]:
+    """返回任一欄位與查詢前綴相符的列索引，依列的順序排列。
+
+    queries 為 欄位 -> 已轉為小寫的查詢字串，空字串表示不查詢該欄位。
+    """
+    # 查詢的前幾個字元不在該欄位的前綴集合中時，不可能相符，直接略過
+    hits = [indexes[field].find(query) for field, query in queries.items()
+            if query and query[:SHORT_PREFIX_LENGTH] in short_prefixes[field]]
+    if not hits:
+        return []
+    if len(hits) == 1:
+        # 只有一個欄位相符時（打字查詢時最常見）不需要建立集合去重
+        return sorted(hits[0])
+    matched: set[int] = set()
+    for row_indices in hits:
+        matched.update(row_indices)
+    return sorted(matched)
@@ -1,17 +1,85 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.exceptions import IllegalCharacterError
 import os
-from datetime import datetime
+import csv
+import atexit
+from datetime import date, datetime, time
 import sys
+import threading
+import multiprocessing
 import traceback # 導入 traceback 以便詳細輸出錯誤
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import zip_longest
+
+# 客戶前綴比對，可用 mypyc 編譯以加速（見 matcher.py）
+from matcher import SortedPrefixIndex, build_short_prefixes, match_rows
+
+try:
+    # 選用：以 Rust 實作的 xlsx 讀取器，讀取速度遠快於 openpyxl
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    # 未安裝時一律使用 openpyxl 讀取
+    CalamineWorkbook = None
+
+try:
+    # 選用：直接修改 xlsx 內的工作表 XML（需要 lxml），不必由 openpyxl 重寫整個檔案
+    import xlsx_patch
+except ImportError:
+    xlsx_patch = None
+
+try:
+    # 選用：以 C 實作的 JSON 編碼器，大量客戶/商品/倉位資料時序列化更快
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # 選用：以 gzip/brotli 壓縮回應內容
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
+try:
+    # 選用：正式環境使用的多執行緒 WSGI 伺服器
+    from waitress import serve
+except ImportError:
+    serve = None
+
+class ORJSONProvider(DefaultJSONProvider):
+    """使用 orjson 進行 JSON 序列化，輸出與 Flask 預設相同（鍵排序、非字串鍵）。"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            # 除錯模式下 Flask 會要求縮排輸出
+            option |= orjson.OPT_INDENT_2
+        # orjson 不支援的型別交給 Flask 預設的轉換方式處理
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # 創建 Flask 應用程式實例
 app = Flask(__name__)
 
+# 已安裝 orjson 時改用它輸出 JSON，jsonify 的呼叫方式不變
+if orjson is not None:
+    app.json = ORJSONProvider(app)
+
 # 啟用 CORS（跨來源資源共享），這允許前端從不同的來源請求 API。
 CORS(app)
 
+# 已安裝 flask-compress 時壓縮回應，倉位圖等大型 JSON 可大幅減少傳輸量
+if Compress is not None:
+    Compress(app)
+
 # =========================================================
 # 檔案和工作表設定
 # =========================================================
@@ -30,6 +98,12 @@ APP_ROOT_PATH = get_app_path()
 
 # 設定 Excel 檔案路徑為應用程式根目錄下的 warehouse_data.xlsx
 EXCEL_FILE = os.path.join(APP_ROOT_PATH, 'warehouse_data.xlsx')
+# 尚未合併進 Excel 的入庫紀錄，每筆提交先附加到這個 CSV 檔
+DATA_LOG_FILE = os.path.join(APP_ROOT_PATH, 'warehouse_data_log.csv')
+# 無法寫入 Excel 的暫存紀錄會移到這個 CSV 檔，避免擋住之後的紀錄
+DATA_REJECT_FILE = os.path.join(APP_ROOT_PATH, 'warehouse_data_rejected.csv')
+# 提交後延遲多少秒才將紀錄合併寫入 Excel，期間的多筆提交只需存檔一次
+FLUSH_DELAY_SECONDS = 2.0
 
 MAP_SHEET_NAME = 'map'
 OPTIONS_SHEET_NAME = 'rowdown'
@@ -57,6 +131,497 @@ if not os.path.exists(EXCEL_FILE):
     except Exception as e:
         print(f"創建 Excel 檔案時發生錯誤: {e}")
 
+# =========================================================
+# 下拉式選單工具
+# =========================================================
+def iter_columns(rows):
+    """將以列為單位的資料轉為逐欄的 tuple，長度不足的列以 None 補齊。"""
+    return zip_longest(*rows)
+
+def unique_options(values):
+    """去除空白與重複的選項，保留第一次出現的順序。"""
+    # dict.fromkeys 會保留插入順序，去重工作在 C 層完成
+    return list(dict.fromkeys(
+        text for text in (str(value).strip() for value in values if value is not None) if text
+    ))
+
+def build_dropdown_options(rows):
+    """將 rowdown 工作表整理為 {標題: 選項列表}。"""
+    dropdown_options = {}
+    for column in iter_columns(rows):
+        header = column[0]
+        if header:
+            dropdown_options[header] = unique_options(column[1:])
+    return dropdown_options
+
+# =========================================================
+# 倉位圖
+# =========================================================
+def build_bin_map(rows):
+    """將 map 工作表的每個格子解析為前端使用的倉位資料。"""
+    max_column = max((len(row_values) for row_values in rows), default=0)
+
+    bin_map_data = []
+    for row, row_values in enumerate(rows, start=1):
+        # 長度不足的列以 None 補齊，確保每一列的格子數相同
+        padding = (None,) * (max_column - len(row_values))
+        for col, cell_value in enumerate(row_values + padding, start=1):
+            position_name = f"{col}-{row}"
+
+            if cell_value and isinstance(cell_value, str):
+                # 格子內容依序為：料桶名稱、原物料、日期、廠商，不足四行以空字串補齊
+                bin_name, item, date, vendor = (cell_value.split('\n') + [''] * 4)[:4]
+                bin_map_data.append({
+                    'positionName': position_name,
+                    'binName': bin_name,
+                    'item': item,
+                    'date': date,
+                    'vendor': vendor,
+                    'binValue': cell_value
+                })
+            else:
+                bin_map_data.append({
+                    'positionName': position_name,
+                    'binName': '',
+                    'binValue': ''
+                })
+    return bin_map_data
+
+# =========================================================
+# 客戶前綴索引
+# =========================================================
+# 客戶查詢欄位：前端使用的英文鍵名 -> Excel 標題
+CUSTOMER_FIELDS = {
+    'id': '客戶編號',
+    'name': '客戶名稱',
+    'phone': '客戶電話',
+    'address': '送貨地址',
+}
+
+def cell_text(row, col):
+    """將列中指定欄位的值轉為去除空白的字串，欄位不存在或為空時返回空字串。"""
+    # 編號、電話、庫存等欄位可能是數字，仍需轉為字串
+    value = row[col] if 0 <= col < len(row) else None
+    return str(value).strip() if value else ''
+
+def resolve_columns(rows, fields, sheet_name):
+    """依標題列找出各欄位的索引，返回 {英文鍵名: 欄位索引}，缺少的欄位為 -1。
+
+    fields 為 英文鍵名 -> Excel 標題。標題只在建立快取時解析一次，
+    每次請求直接使用解析好的索引。
+    """
+    headers = [str(value).strip() if value is not None else '' for value in rows[0]] if rows else []
+    column_index = {}
+    for field, header in fields.items():
+        try:
+            column_index[field] = headers.index(header)
+        except ValueError:
+            # 即使缺少欄位也不中斷，但會記錄
+            column_index[field] = -1
+            print(f"Warning: Missing header '{header}' in sheet '{sheet_name}'")
+    return column_index
+
+def build_customer_index(rows):
+    """將客戶工作表整理為顯示用的客戶列表，以及每個查詢欄位的前綴集合與前綴索引。"""
+    # 確定欄位索引，用於查詢和映射
+    column_index = resolve_columns(rows, CUSTOMER_FIELDS, CUSTOMER_SHEET_NAME)
+    data_rows = rows[1:]
+
+    # 以欄為單位整理：每個欄位一份顯示用的值，以及一份預先轉為小寫的值供建立索引，
+    # 查詢時不必再對每一列呼叫 str()/strip()/lower()。
+    # 如果行數據長度不足或缺少欄位，使用空字符串
+    values = {field: [cell_text(row, col) for row in data_rows]
+              for field, col in column_index.items()}
+    lowered = {field: [value.lower() for value in column]
+               for field, column in values.items()}
+
+    # 顯示用的客戶資料，欄位名稱為前端需要的英文字段
+    display = [dict(zip(values, customer)) for customer in zip(*values.values())]
+
+    # 每個欄位所有值的前 1～3 個字元，打字過程中常見的不相符前綴可直接排除
+    short_prefixes = {field: build_short_prefixes(column) for field, column in lowered.items()}
+
+    prefix_indexes = {field: SortedPrefixIndex(column) for field, column in lowered.items()}
+
+    return {'display': display, 'short_prefixes': short_prefixes, 'prefix_indexes': prefix_indexes}
+
+# =========================================================
+# 商品資料
+# =========================================================
+# 商品欄位：前端使用的英文鍵名 -> Excel 標題
+GOODS_FIELDS = {
+    'name': '品名',
+    'spec': '規格',
+    'stock': '庫存',
+}
+
+def build_goods_list(rows):
+    """將商品工作表整理為前端使用的商品列表。"""
+    column_index = resolve_columns(rows, GOODS_FIELDS, GOODS_SHEET_NAME)
+    # 從第二行開始，為了前端方便，將中文 key 轉換為英文 key
+    return [{field: cell_text(row, col) for field, col in column_index.items()}
+            for row in rows[1:]]
+
+# =========================================================
+# 工作表快取
+# =========================================================
+# 工作表名稱 -> (檔案修改時間, 解析後的資料)
+# 只要 Excel 檔案沒有被修改，GET 請求就直接使用記憶體中的資料，不必重新解析 xlsx。
+_SHEET_CACHE = {}
+
+# 需要額外整理的工作表：工作表名稱 -> 解析函式（輸入所有列，輸出要快取的資料）
+# 未列出的工作表直接快取所有列的值。
+_SHEET_PARSERS = {
+    CUSTOMER_SHEET_NAME: build_customer_index,
+    GOODS_SHEET_NAME: build_goods_list,
+    OPTIONS_SHEET_NAME: build_dropdown_options,
+    MAP_SHEET_NAME: build_bin_map,
+}
+
+# 平行解析工作表用的行程池，第一次需要時才建立
+_PROCESS_POOL = None
+_PROCESS_POOL_LOCK = threading.Lock()
+
+def get_process_pool():
+    """返回共用的行程池，尚未建立時建立一個。"""
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is None:
+            # 由請求執行緒建立行程池，固定使用 spawn：在多執行緒的行程中 fork 可能死鎖，
+            # 也讓 Linux 上的行為與 Windows 打包版本一致
+            _PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+        return _PROCESS_POOL
+
+def shutdown_process_pool():
+    """關閉行程池，下次需要時重新建立。"""
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is not None:
+            _PROCESS_POOL.shutdown(wait=False)
+            _PROCESS_POOL = None
+
+def get_excel_mtime():
+    """返回 Excel 檔案的修改時間（奈秒），作為快取是否有效的依據。"""
+    return os.stat(EXCEL_FILE).st_mtime_ns
+
+def read_sheet_with_calamine(path, name):
+    """使用 python-calamine 讀取工作表，並將值轉換成與 openpyxl 相同的格式。"""
+    wb = CalamineWorkbook.from_path(path)
+    try:
+        if name not in wb.sheet_names:
+            raise KeyError(f"Worksheet {name} does not exist.")
+        values = wb.get_sheet_by_name(name).to_python(skip_empty_area=False)
+    finally:
+        wb.close()
+
+    rows = []
+    for row in values:
+        # calamine 以空字串表示空白儲存格，所有數字都是 float，
+        # 且午夜的日期時間會返回 date，openpyxl 則一律返回 datetime
+        rows.append(tuple(
+            None if value == '' else
+            int(value) if isinstance(value, float) and value.is_integer() else
+            datetime.combine(value, time()) if type(value) is date else
+            value
+            for value in row
+        ))
+    return rows
+
+def read_sheet_with_openpyxl(path, name):
+    """以 openpyxl 唯讀模式讀取工作表所有列的值。"""
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        # 工作表不存在時 openpyxl 會拋出 KeyError
+        ws = wb[name]
+        try:
+            ws.calculate_dimension()
+        except ValueError:
+            # 檔案缺少尺寸資訊 (部分工具產生的 xlsx) 時，改為依實際內容計算範圍
+            ws.reset_dimensions()
+        return [tuple(row) for row in ws.values]
+    finally:
+        # 唯讀模式會保持檔案開啟，必須手動關閉
+        wb.close()
+
+def parse_rows(name, rows):
+    """將工作表所有列經過對應的解析函式整理，未註冊解析函式時直接返回所有列。"""
+    parser = _SHEET_PARSERS.get(name)
+    return parser(rows) if parser else rows
+
+def parse_sheet(path, name):
+    """讀取並整理指定的工作表，也會在行程池的子行程中執行。"""
+    # 倉位圖的格子數量取決於工作表的尺寸資訊（包含只有格式的空白格），
+    # calamine 只會讀到有值的範圍，因此倉位圖仍使用 openpyxl 讀取。
+    if CalamineWorkbook is not None and name != MAP_SHEET_NAME:
+        rows = read_sheet_with_calamine(path, name)
+    else:
+        rows = read_sheet_with_openpyxl(path, name)
+    return parse_rows(name, rows)
+
+def load_sheet(name):
+    """讀取指定工作表並經過對應的解析函式整理，檔案未變更時直接返回快取。"""
+    mtime = get_excel_mtime()
+    cached = _SHEET_CACHE.get(name)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    data = parse_sheet(EXCEL_FILE, name)
+    _SHEET_CACHE[name] = (mtime, data)
+    return data
+
+def load_sheets(*names):
+    """一次讀取多個工作表，返回順序與 names 相同。
+
+    有兩個以上的工作表需要重新解析時，交給行程池平行處理，
+    避開 GIL 讓 XML 解析同時使用多個 CPU 核心。
+    """
+    mtime = get_excel_mtime()
+    missing = [name for name in names
+               if name not in _SHEET_CACHE or _SHEET_CACHE[name][0] != mtime]
+    if len(missing) > 1:
+        try:
+            executor = get_process_pool()
+            futures = {name: executor.submit(parse_sheet, EXCEL_FILE, name) for name in missing}
+            for name, future in futures.items():
+                _SHEET_CACHE[name] = (mtime, future.result())
+        except BrokenProcessPool:
+            # 子行程異常結束時重建行程池，這次改為逐一讀取
+            shutdown_process_pool()
+            traceback.print_exc()
+    return [load_sheet(name) for name in names]
+
+def warm_sheet_cache():
+    """預先讀取所有 GET 端點會用到的工作表，讓快取在接受請求前就準備好。"""
+    for name in (CUSTOMER_SHEET_NAME, GOODS_SHEET_NAME, SALE_ROWDOWN_NAME,
+                 OPTIONS_SHEET_NAME, MAP_SHEET_NAME):
+        try:
+            load_sheet(name)
+        except Exception:
+            # 缺少工作表等錯誤留給對應的 API 回報，不影響伺服器啟動
+            traceback.print_exc()
+
+def store_sheet(name, mtime, rows):
+    """將工作表所有列經過對應的解析函式整理後存入快取，並返回整理後的資料。"""
+    data = parse_rows(name, rows)
+    _SHEET_CACHE[name] = (mtime, data)
+    return data
+
+def refresh_sheet_cache(wb, old_mtime, changed_sheets):
+    """寫入檔案後更新快取，不必重新解析整個 xlsx。
+
+    wb 為剛存檔的工作簿（沒有時為 None），old_mtime 為它存檔前對應的檔案版本。
+    未修改的工作表若快取屬於該版本，內容仍然正確，只需更新修改時間；
+    修改過的工作表直接從記憶體中的工作簿取值重建（只讀值，不碰樣式）；
+    其他過期的快取則移除，等下次請求時再讀取。
+    """
+    mtime = get_excel_mtime()
+    for name, (cached_mtime, data) in list(_SHEET_CACHE.items()):
+        if name in changed_sheets and wb is None:
+            # 沒有可用的工作簿時，修改過的工作表等下次請求再重新讀取
+            del _SHEET_CACHE[name]
+        elif name in changed_sheets:
+            store_sheet(name, mtime, [tuple(row) for row in wb[name].values])
+        elif cached_mtime == old_mtime:
+            _SHEET_CACHE[name] = (mtime, data)
+        else:
+            del _SHEET_CACHE[name]
+
+# =========================================================
+# 寫入用的工作簿
+# =========================================================
+# 寫入時使用常駐記憶體的工作簿，不必每次 POST 都重新解析整個 xlsx。
+# 所有存取都必須持有 _WB_LOCK。
+_WB = None
+_WB_MTIME = None
+_WB_LOCK = threading.Lock()
+
+def get_write_workbook():
+    """返回常駐的可寫入工作簿，若 Excel 檔案曾被外部修改則重新載入。"""
+    global _WB, _WB_MTIME
+    mtime = get_excel_mtime()
+    if _WB is None or _WB_MTIME != mtime:
+        _WB = openpyxl.load_workbook(EXCEL_FILE)
+        _WB_MTIME = mtime
+        # 重新套用尚未寫入檔案的倉位更新，讓讀取到的倉位圖保持最新
+        for position, cell_value, *_ in reject_unwritable_entries(read_data_log()):
+            set_map_cell(_WB, position, cell_value)
+    return _WB
+
+def save_write_workbook(changed_sheets):
+    """將常駐的工作簿存回 Excel 檔案，並依修改過的工作表更新讀取快取。"""
+    global _WB_MTIME
+    old_mtime = _WB_MTIME
+    _WB.save(EXCEL_FILE)
+    _WB_MTIME = get_excel_mtime()
+    refresh_sheet_cache(_WB, old_mtime, changed_sheets)
+
+def discard_write_workbook():
+    """丟棄常駐的工作簿，下次寫入時重新從檔案載入。"""
+    global _WB, _WB_MTIME
+    _WB = None
+    _WB_MTIME = None
+
+# Excel 工作表的欄、列上限（與 openpyxl 相同）
+MAX_COLUMN = 16384
+MAX_ROW = 1048576
+
+def parse_position(position):
+    """將 '欄-列' 格式的倉位名稱轉為 (欄, 列) 整數，超出工作表範圍時拋出 ValueError。"""
+    col_index, row_index = map(int, position.split('-'))
+    if not (1 <= col_index <= MAX_COLUMN and 1 <= row_index <= MAX_ROW):
+        raise ValueError(f"倉位 '{position}' 超出工作表範圍")
+    return col_index, row_index
+
+def set_map_cell(wb, position, cell_value):
+    """更新倉位圖中指定倉位的內容。"""
+    col_index, row_index = parse_position(position)
+    wb[MAP_SHEET_NAME].cell(row=row_index, column=col_index, value=cell_value)
+
+# =========================================================
+# 入庫紀錄暫存 (CSV)
+# =========================================================
+# 每次提交只附加一行到 CSV，不必重寫整個 xlsx；
+# 紀錄會在 FLUSH_DELAY_SECONDS 後（或程式結束時）一次合併進 Excel。
+# CSV 每行為：倉位名稱, 倉位格內容, 以及要附加到 DATA_SHEET_NAME 的整列資料。
+# 所有存取都必須持有 _WB_LOCK。
+_PENDING_COUNT = 0
+_FLUSH_TIMER = None
+
+def check_writable(position, cell_value, new_row):
+    """確認一筆提交可以寫入 Excel，否則拋出與 openpyxl 寫入時相同的錯誤。"""
+    parse_position(position)
+    for value in [cell_value, *new_row]:
+        if isinstance(value, str) and ILLEGAL_CHARACTERS_RE.search(value):
+            raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+
+def append_data_log(position, cell_value, new_row, path=DATA_LOG_FILE):
+    """將一筆提交附加到 CSV 暫存檔。"""
+    timestamp, *values = new_row
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(
+            [position, cell_value, timestamp.isoformat()]
+            + ['' if value is None else value for value in values]
+        )
+
+def read_data_log():
+    """讀取 CSV 暫存檔中所有尚未合併的紀錄，格式與 append_data_log 的參數相同。"""
+    if not os.path.exists(DATA_LOG_FILE):
+        return []
+    entries = []
+    with open(DATA_LOG_FILE, newline='', encoding='utf-8') as f:
+        for position, cell_value, timestamp, *values in csv.reader(f):
+            new_row = [datetime.fromisoformat(timestamp)] + [value or None for value in values]
+            entries.append((position, cell_value, new_row))
+    return entries
+
+def reject_unwritable_entries(entries):
+    """將無法寫入 Excel 的紀錄移到 DATA_REJECT_FILE，返回其餘的紀錄。
+
+    這類紀錄重試也不會成功，留在暫存檔中會讓之後的紀錄都無法合併。
+    """
+    writable = []
+    rejected = []
+    for entry in entries:
+        try:
+            check_writable(*entry)
+        except (ValueError, IllegalCharacterError):
+            rejected.append(entry)
+        else:
+            writable.append(entry)
+    if not rejected:
+        return entries
+
+    print(f"有 {len(rejected)} 筆紀錄無法寫入 Excel，已移到 {DATA_REJECT_FILE}")
+    for entry in rejected:
+        append_data_log(*entry, path=DATA_REJECT_FILE)
+    # 先寫到暫存檔再取代，避免中途失敗時遺失可寫入的紀錄
+    tmp_path = DATA_LOG_FILE + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    for entry in writable:
+        append_data_log(*entry, path=tmp_path)
+    if writable:
+        os.replace(tmp_path, DATA_LOG_FILE)
+    else:
+        os.remove(DATA_LOG_FILE)
+    return writable
+
+def schedule_flush():
+    """在 FLUSH_DELAY_SECONDS 後合併暫存紀錄，已排程時不重複排程。"""
+    global _FLUSH_TIMER
+    if _FLUSH_TIMER is None:
+        _FLUSH_TIMER = threading.Timer(FLUSH_DELAY_SECONDS, flush_pending_writes)
+        _FLUSH_TIMER.daemon = True
+        _FLUSH_TIMER.start()
+
+def patch_pending_writes(entries):
+    """直接修改 xlsx 中的倉位圖與入庫紀錄工作表 XML，成功時返回 True。
+
+    只重寫這兩個工作表的 XML，其他工作表與共用字串表原樣保留。
+    未安裝 lxml 或檔案結構無法處理時返回 False，由呼叫端改用 openpyxl 存檔。
+    """
+    global _WB_MTIME
+    if xlsx_patch is None:
+        return False
+
+    old_mtime = get_excel_mtime()
+    map_updates = []
+    for position, cell_value, _ in entries:
+        col_index, row_index = parse_position(position)
+        map_updates.append((row_index, col_index, cell_value))
+    try:
+        xlsx_patch.patch_xlsx(
+            EXCEL_FILE,
+            cell_updates={MAP_SHEET_NAME: map_updates},
+            appended_rows={DATA_SHEET_NAME: [new_row for _, _, new_row in entries]},
+        )
+    except Exception:
+        # 修改失敗時原檔案不會被取代，改用 openpyxl 存檔
+        print("無法直接修改 Excel 檔案，改用 openpyxl 存檔")
+        traceback.print_exc()
+        return False
+    os.remove(DATA_LOG_FILE)
+
+    if _WB is not None and _WB_MTIME == old_mtime:
+        # 常駐工作簿與修改前的檔案一致（倉位更新已套用），補上附加的紀錄即可繼續使用
+        data_sheet = _WB[DATA_SHEET_NAME]
+        for _, _, new_row in entries:
+            data_sheet.append(new_row)
+        _WB_MTIME = get_excel_mtime()
+        refresh_sheet_cache(_WB, old_mtime, {DATA_SHEET_NAME, MAP_SHEET_NAME})
+    else:
+        discard_write_workbook()
+        refresh_sheet_cache(None, old_mtime, {DATA_SHEET_NAME, MAP_SHEET_NAME})
+    return True
+
+def flush_pending_writes():
+    """將 CSV 暫存檔中的紀錄附加到 DATA_SHEET_NAME 並存檔，成功後刪除暫存檔。"""
+    global _PENDING_COUNT, _FLUSH_TIMER
+    with _WB_LOCK:
+        if _FLUSH_TIMER is not None:
+            _FLUSH_TIMER.cancel()
+            _FLUSH_TIMER = None
+
+        try:
+            entries = reject_unwritable_entries(read_data_log())
+            if not entries:
+                return
+            if not patch_pending_writes(entries):
+                # 倉位更新在提交時（或重新載入時）已套用到工作簿，這裡只需附加紀錄
+                wb = get_write_workbook()
+                data_sheet = wb[DATA_SHEET_NAME]
+                for _, _, new_row in entries:
+                    data_sheet.append(new_row)
+                save_write_workbook({DATA_SHEET_NAME, MAP_SHEET_NAME})
+                os.remove(DATA_LOG_FILE)
+            _PENDING_COUNT = 0
+        except Exception:
+            # 存檔失敗時保留暫存檔，丟棄記憶體中附加了一半的工作簿，下次再重試
+            discard_write_workbook()
+            traceback.print_exc()
+            schedule_flush()
+
 # =========================================================
 # 前端靜態檔案伺服器
 # =========================================================
@@ -96,71 +661,19 @@ def get_customers():
         if not (id_query or name_query or phone_query or address_query):
             return jsonify([])
 
-        # 注意：此處仍保留每次請求都讀取 Excel 檔案的邏輯，會影響效能。
-        # 建議參考先前提供的 customer_search_backend.py 檔案，使用記憶體快取。
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        customer_sheet = wb[CUSTOMER_SHEET_NAME]
-        
-        customers = []
-        
-        # 獲取標題列 (假設是第一行)
-        headers = [str(cell.value) for cell in customer_sheet[1]]
-        
-        # 確定欄位索引，用於查詢和映射
-        header_map = {
-            '客戶編號': -1, '客戶名稱': -1, '客戶電話': -1, '送貨地址': -1
-        }
-        for key in header_map.keys():
-            try:
-                header_map[key] = headers.index(key)
-            except ValueError:
-                # 即使缺少欄位也不中斷，但會記錄
-                print(f"Warning: Missing header '{key}' in sheet '{CUSTOMER_SHEET_NAME}'")
-
-        # 從第二行開始遍歷數據
-        for row in customer_sheet.iter_rows(min_row=2):
-            # 將行數據轉換為字典
-            row_data = [str(cell.value or '').strip() for cell in row]
-            
-            customer_info = {}
-            for i, header in enumerate(headers):
-                # 如果行數據長度不足，使用空字符串
-                customer_info[header] = row_data[i] if i < len(row_data) else ''
-
-            is_match = False
-            
-            # --- 核心修改：將 'in' 替換為 '.startswith()' 實現前綴比對 ---
-            
-            # 1. 客戶編號比對
-            id_val = customer_info.get('客戶編號', '').lower()
-            if id_query and id_val and id_val.startswith(id_query):
-                is_match = True
-            
-            # 2. 客戶名稱比對
-            name_val = customer_info.get('客戶名稱', '').lower()
-            if not is_match and name_query and name_val and name_val.startswith(name_query):
-                is_match = True
-
-            # 3. 客戶電話比對
-            phone_val = customer_info.get('客戶電話', '').lower()
-            if not is_match and phone_query and phone_val and phone_val.startswith(phone_query):
-                is_match = True
-
-            # 4. 送貨地址比對
-            address_val = customer_info.get('送貨地址', '').lower()
-            if not is_match and address_query and address_val and address_val.startswith(address_query):
-                is_match = True
-
-            if is_match:
-                # 映射 Excel 欄位（中文）到前端需要的英文字段
-                formatted_customer = {
-                    'id': customer_info.get('客戶編號', ''),
-                    'name': customer_info.get('客戶名稱', ''),
-                    'phone': customer_info.get('客戶電話', ''),
-                    'address': customer_info.get('送貨地址', '')
-                }
-                customers.append(formatted_customer)
-        
+        # 使用快取的客戶索引，Excel 檔案未變更時不需重新解析
+        customer_index = load_sheet(CUSTOMER_SHEET_NAME)
+
+        # 任一欄位前綴相符即列入結果，依 Excel 中的順序返回
+        row_indices = match_rows(
+            {'id': id_query, 'name': name_query, 'phone': phone_query, 'address': address_query},
+            customer_index['short_prefixes'],
+            customer_index['prefix_indexes'],
+        )
+
+        # 以 C 層的 map 取出顯示資料，不在 Python 迴圈中逐一索引
+        customers = list(map(customer_index['display'].__getitem__, row_indices))
+
         return jsonify(customers)
     
     except Exception as e:
@@ -174,33 +687,8 @@ def get_customers():
 def get_goods_data():
     """從 goods_sheet 工作表讀取所有商品資料。"""
     try:
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        goods_sheet = wb[GOODS_SHEET_NAME]
-
-        goods_data = []
-        # 獲取標題列並過濾掉 None 值
-        headers = [str(cell.value).strip() for cell in goods_sheet[1] if cell.value]
-
-        # 從第二行開始遍歷數據
-        for row in goods_sheet.iter_rows(min_row=2):
-            # 將行數據轉換為字串
-            # row_data = [str(cell.value or '').strip() for cell in row]
-            row_dict = {headers[i]: (str(cell.value).strip() if cell.value else '') 
-                        for i, cell in enumerate(row)}
-            
-            # # 將行數據映射到字典
-            # item = {}
-            # for i, header in enumerate(headers):
-            #     if i < len(row_data):
-            #         item[header] = row_data[i]
-            
-            # 為了前端方便，將中文 key 轉換為英文 key
-            formatted_item = {
-                'name': row_dict.get('品名', ''),
-                'spec': row_dict.get('規格', ''),
-                'stock': row_dict.get('庫存', ''),
-            }
-            goods_data.append(formatted_item)
+        # 商品列表在讀取工作表時就整理好，這裡直接使用快取結果
+        goods_data = load_sheet(GOODS_SHEET_NAME)
 
         return jsonify(goods_data)
 
@@ -222,45 +710,20 @@ def get_rowdown_data():
         '車號': 'carNumbers',
     }  
     try:
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        
-        if SALE_ROWDOWN_NAME not in wb.sheetnames:
+        try:
+            options_values = load_sheet(SALE_ROWDOWN_NAME)
+        except KeyError:
             return jsonify({"status": "error", "message": f"Excel中找不到工作表: {SALE_ROWDOWN_NAME}"}), 500
-            
-        options_sheet = wb[SALE_ROWDOWN_NAME]
-        options_values = list(options_sheet.values)
-        
+
         lookup_data = {}
 
-        if options_values:
-            # 2. 提取標頭 (第一行) 和數據行 (從第二行開始)
-            options_header = options_values[0]
-            options_data_rows = options_values[1:]
-            
-            # 3. 遍歷每個欄位，提取數據並進行鍵名轉換
-            for col_index, header in enumerate(options_header):
-                # 檢查標頭是否在我們需要的對應列表中
-                # 使用 str() 確保 header 是一個字串，以避免 NoneType 錯誤
-                if isinstance(header, str) and header in HEADER_TO_JSON_KEY:
-                    
-                    # 獲取目標 JSON 鍵名
-                    json_key = HEADER_TO_JSON_KEY[header]
-                    options_list = []
-                    seen_options = set() # 用於去重 (優化)
-                    
-                    # 遍歷所有數據行，提取該欄位的值
-                    for row in options_data_rows:
-                        # 檢查該行在當前欄位是否有值
-                        if len(row) > col_index and row[col_index] is not None:
-                            value = str(row[col_index]).strip()
-                            
-                            # 檢查值是否非空且尚未出現過
-                            if value and value not in seen_options:
-                                seen_options.add(value)
-                                options_list.append(value)
-                                
-                    # 將結果存入字典，使用轉換後的 JSON 鍵名
-                    lookup_data[json_key] = options_list
+        # 2. 逐欄遍歷，每一欄的第一個值為標頭，其餘為數據
+        for column in iter_columns(options_values):
+            header = column[0]
+            # 3. 檢查標頭是否在我們需要的對應列表中，並進行鍵名轉換
+            # 使用 isinstance 確保 header 是一個字串，以避免 NoneType 錯誤
+            if isinstance(header, str) and header in HEADER_TO_JSON_KEY:
+                lookup_data[HEADER_TO_JSON_KEY[header]] = unique_options(column[1:])
 
         # 4. 返回 JSON 格式的下拉選單數據
         return jsonify({
@@ -280,55 +743,25 @@ def get_rowdown_data():
 @app.route('/api/data', methods=['GET'])
 def get_data():
     try:
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        
-        options_sheet = wb[OPTIONS_SHEET_NAME]
-        options_values = list(options_sheet.values)
-        dropdown_options = {}
-        if options_values:
-            options_header = options_values[0]
-            options_data_rows = options_values[1:]
-            
-            for col_index, header in enumerate(options_header):
-                if header:
-                    options_list = []
-                    seen_options = set()
-                    for row in options_data_rows:
-                        if len(row) > col_index and row[col_index] is not None:
-                            value = str(row[col_index]).strip()
-                            if value and value not in seen_options:
-                                seen_options.add(value)
-                                options_list.append(value)
-                    dropdown_options[header] = options_list
-
-        map_sheet = wb[MAP_SHEET_NAME]
-        bin_map_data = []
-        for row in range(1, map_sheet.max_row + 1):
-            for col in range(1, map_sheet.max_column + 1):
-                cell_value = map_sheet.cell(row, col).value
-                position_name = f"{col}-{row}"
-                
-                if cell_value and isinstance(cell_value, str):
-                    lines = cell_value.split('\n')
-                    bin_map_data.append({
-                        'positionName': position_name,
-                        'binName': lines[0] if len(lines) > 0 else '',
-                        'item': lines[1] if len(lines) > 1 else '',
-                        'date': lines[2] if len(lines) > 2 else '',
-                        'vendor': lines[3] if len(lines) > 3 else '',
-                        'binValue': cell_value
-                    })
-                else:
-                    bin_map_data.append({
-                        'positionName': position_name,
-                        'binName': '',
-                        'binValue': ''
-                    })
-        
-        return jsonify({
+        # 回應內容只會隨 Excel 檔案及尚未合併的提交變更，以兩者作為 ETag，
+        # 前端重複輪詢時若資料未變更就直接返回 304，不必再序列化整份資料。
+        etag = f"{get_excel_mtime():x}-{_PENDING_COUNT}"
+        # flask-compress 壓縮回應時會在 ETag 後加上 ":gzip" 等壓縮方式，比對時先去掉
+        for client_etag in request.if_none_match.as_set(include_weak=True):
+            if client_etag.split(':')[0] == etag:
+                response = make_response('', 304)
+                response.set_etag(client_etag)
+                return response
+
+        # 下拉選單與倉位圖都在讀取工作表時就整理好，這裡直接使用快取結果
+        dropdown_options, bin_map_data = load_sheets(OPTIONS_SHEET_NAME, MAP_SHEET_NAME)
+
+        response = jsonify({
             "dropdownOptions": dropdown_options,
             "binMapData": bin_map_data
         })
+        response.set_etag(etag)
+        return response
         
     except Exception as e:
         traceback.print_exc()
@@ -339,13 +772,11 @@ def get_data():
 # =========================================================
 @app.route('/api/submit', methods=['POST'])
 def submit_data():
+    global _PENDING_COUNT
     try:
         form_data = request.form
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        
         timestamp = datetime.now()
-        
-        data_sheet = wb[DATA_SHEET_NAME]
+
         new_row = [
             timestamp,
             form_data.get('日期'),
@@ -359,26 +790,37 @@ def submit_data():
             form_data.get('初估碾米率'),
             form_data.get('備註')
         ]
-        data_sheet.append(new_row)
-        
-        map_sheet = wb[MAP_SHEET_NAME]
+
         bin_position = form_data.get('positionName')
         bin_display_name = form_data.get('料桶')
-        
+
+        # 先驗證參數再修改工作簿，避免常駐的工作簿留下寫了一半的資料
         if not bin_position:
             raise ValueError("缺少 'positionName' 參數")
-            
-        col_index, row_index = map(int, bin_position.split('-'))
-        
+
         new_cell_value = (
             f"{bin_display_name}\n"
             f"{form_data.get('輸入原物料')}\n"
             f"{form_data.get('日期')}\n"
             f"{form_data.get('廠商名稱')}"
         )
-        map_sheet.cell(row=row_index, column=col_index, value=new_cell_value)
-        
-        wb.save(EXCEL_FILE)
+        check_writable(bin_position, new_cell_value, new_row)
+
+        with _WB_LOCK:
+            try:
+                # 倉位圖的修改先套用在記憶體中的工作簿，並立即更新倉位圖的讀取快取
+                wb = get_write_workbook()
+                set_map_cell(wb, bin_position, new_cell_value)
+                append_data_log(bin_position, new_cell_value, new_row)
+            except Exception:
+                # 寫入失敗時丟棄記憶體中的修改，下次請求重新從檔案載入
+                discard_write_workbook()
+                raise
+            store_sheet(MAP_SHEET_NAME, _WB_MTIME, [tuple(row) for row in wb[MAP_SHEET_NAME].values])
+            # 讀取 ETag 時不持有鎖，計數要在快取更新後才遞增，避免新的 ETag 配上舊的倉位圖
+            _PENDING_COUNT += 1
+            schedule_flush()
+
         return jsonify({"status": "success"})
         
     except Exception as e:
@@ -389,5 +831,20 @@ def submit_data():
 # 主程式入口點
 # =========================================================
 if __name__ == '__main__':
-    # 確保 Flask 在您指定的端口運行
-    app.run(debug=True, host='0.0.0.0', port=5719)
+    # 打包成 .exe 後，行程池的子行程需要這個呼叫才能正常啟動
+    multiprocessing.freeze_support()
+
+    # 啟動時將上次未合併的紀錄寫入 Excel，並在程式結束前合併最後的紀錄。
+    # 放在這裡而不是模組層級，避免行程池的子行程匯入本模組時也執行寫入。
+    flush_pending_writes()
+    atexit.register(flush_pending_writes)
+
+    # 在開始接受請求前先讀好所有工作表，第一個請求不必等待解析 Excel
+    warm_sheet_cache()
+
+    # 確保伺服器在您指定的端口運行
+    if serve is not None:
+        serve(app, host='0.0.0.0', port=5719, threads=8)
+    else:
+        # 未安裝 waitress 時退回 Flask 內建伺服器，關閉除錯模式與自動重新載入
+        app.run(debug=False, host='0.0.0.0', port=5719, threaded=True)
@@ -0,0 +1,203 @@
+"""直接修改 xlsx 檔案中的工作表 XML。
+
+openpyxl 存檔時會重新產生所有工作表與共用字串表；本模組只重寫需要修改的工作表 XML，
+其他檔案原封不動地複製到新的 xlsx。字串一律寫成內嵌字串 (inlineStr)，
+不必改動共用字串表。
+
+需要 lxml（保留 Excel 使用的命名空間前綴）。遇到無法處理的檔案結構時拋出
+XlsxPatchError，呼叫端應改用 openpyxl 寫入。
+"""
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+
+from lxml import etree
+from openpyxl.utils.cell import (
+    column_index_from_string, coordinate_from_string, get_column_letter, range_boundaries,
+)
+from openpyxl.utils.datetime import to_excel
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+ROW_TAG = f'{{{MAIN_NS}}}row'
+CELL_TAG = f'{{{MAIN_NS}}}c'
+
+
+class XlsxPatchError(Exception):
+    """xlsx 的結構不符合預期，無法直接修改。"""
+
+
+def find_sheet_paths(zf):
+    """返回 {工作表名稱: 工作表 XML 在壓縮檔中的路徑}。"""
+    try:
+        workbook = etree.fromstring(zf.read('xl/workbook.xml'))
+        rels = etree.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    except KeyError as e:
+        raise XlsxPatchError(f"找不到活頁簿定義: {e}")
+
+    # 日期序號以 1904 年為基準的檔案不處理
+    workbook_pr = workbook.find(f'{{{MAIN_NS}}}workbookPr')
+    if workbook_pr is not None and workbook_pr.get('date1904') in ('1', 'true'):
+        raise XlsxPatchError("不支援 1904 日期系統")
+
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+    paths = {}
+    for sheet in workbook.iter(f'{{{MAIN_NS}}}sheet'):
+        target = targets.get(sheet.get(f'{{{REL_NS}}}id'))
+        if target is None:
+            continue
+        if target.startswith('/'):
+            paths[sheet.get('name')] = target[1:]
+        else:
+            paths[sheet.get('name')] = posixpath.normpath(posixpath.join('xl', target))
+    return paths
+
+
+class SheetXml:
+    """單一工作表 XML 的修改操作。"""
+
+    def __init__(self, data):
+        self.root = etree.fromstring(data)
+        self.sheet_data = self.root.find(f'{{{MAIN_NS}}}sheetData')
+        if self.sheet_data is None:
+            raise XlsxPatchError("工作表缺少 sheetData")
+
+        self.rows = {}
+        for row in self.sheet_data.iterchildren(ROW_TAG):
+            if row.get('r') is None:
+                raise XlsxPatchError("列缺少 r 屬性")
+            self.rows[int(row.get('r'))] = row
+
+    def max_row(self):
+        """返回最後一個包含儲存格的列號，與 openpyxl 的 max_row 相同。"""
+        return max((r for r, row in self.rows.items() if row.find(CELL_TAG) is not None), default=0)
+
+    def get_row(self, row_index):
+        """返回指定列的元素，不存在時依列號順序插入新的列。"""
+        row = self.rows.get(row_index)
+        if row is None:
+            row = etree.Element(ROW_TAG, r=str(row_index))
+            following = [r for r in self.rows if r > row_index]
+            if following:
+                self.rows[min(following)].addprevious(row)
+            else:
+                self.sheet_data.append(row)
+            self.rows[row_index] = row
+        # spans 只是讀取時的提示，修改後可能不正確，直接移除
+        row.attrib.pop('spans', None)
+        return row
+
+    def get_cell(self, row_index, col_index):
+        """返回指定儲存格的元素，不存在時依欄位順序插入新的儲存格。"""
+        row = self.get_row(row_index)
+        ref = f"{get_column_letter(col_index)}{row_index}"
+        for cell in row.iterchildren(CELL_TAG):
+            if cell.get('r') is None:
+                raise XlsxPatchError("儲存格缺少 r 屬性")
+            cell_col = column_index_from_string(coordinate_from_string(cell.get('r'))[0])
+            if cell_col == col_index:
+                return cell
+            if cell_col > col_index:
+                new_cell = etree.Element(CELL_TAG, r=ref)
+                cell.addprevious(new_cell)
+                return new_cell
+        new_cell = etree.SubElement(row, CELL_TAG, r=ref)
+        return new_cell
+
+    def set_value(self, row_index, col_index, value, style=None):
+        """寫入儲存格的值，保留原有的樣式；value 為 None 時不建立儲存格。"""
+        if value is None:
+            return
+        cell = self.get_cell(row_index, col_index)
+        for child in list(cell):
+            cell.remove(child)
+        cell.attrib.pop('t', None)
+        if style is not None:
+            cell.set('s', style)
+
+        if isinstance(value, str):
+            cell.set('t', 'inlineStr')
+            text = etree.SubElement(etree.SubElement(cell, f'{{{MAIN_NS}}}is'), f'{{{MAIN_NS}}}t')
+            text.text = value
+            if value != value.strip():
+                text.set(XML_SPACE, 'preserve')
+        elif isinstance(value, datetime):
+            if cell.get('s') is None:
+                # 沒有日期格式的日期只會顯示成數字
+                raise XlsxPatchError("日期儲存格缺少樣式")
+            etree.SubElement(cell, f'{{{MAIN_NS}}}v').text = repr(to_excel(value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            etree.SubElement(cell, f'{{{MAIN_NS}}}v').text = repr(value)
+        else:
+            raise XlsxPatchError(f"不支援的儲存格型別: {type(value).__name__}")
+
+        self.expand_dimension(row_index, col_index)
+
+    def append(self, values):
+        """在最後一列之後附加一列；日期沿用上一列同一欄的樣式。"""
+        last_row = self.max_row()
+        previous = self.rows.get(last_row)
+        row_index = last_row + 1
+        for col_index, value in enumerate(values, start=1):
+            style = None
+            if isinstance(value, datetime) and previous is not None:
+                above = previous.find(f"{CELL_TAG}[@r='{get_column_letter(col_index)}{last_row}']")
+                if above is not None and above.get('t') in (None, 'n'):
+                    style = above.get('s')
+            self.set_value(row_index, col_index, value, style)
+
+    def expand_dimension(self, row_index, col_index):
+        """讓工作表的尺寸資訊包含指定的儲存格。"""
+        dimension = self.root.find(f'{{{MAIN_NS}}}dimension')
+        if dimension is None:
+            return
+        min_col, min_row, max_col, max_row = range_boundaries(dimension.get('ref'))
+        max_col = max(max_col or min_col, col_index)
+        max_row = max(max_row or min_row, row_index)
+        dimension.set('ref', f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}")
+
+    def tobytes(self):
+        return etree.tostring(self.root, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+
+def patch_xlsx(path, cell_updates=None, appended_rows=None):
+    """修改 xlsx 中指定工作表的儲存格並附加列，只重寫相關的工作表 XML。
+
+    cell_updates 為 {工作表名稱: [(列, 欄, 值), ...]}，依序寫入；
+    appended_rows 為 {工作表名稱: [列的值, ...]}，附加在最後一列之後。
+    新檔案先寫到同一目錄的暫存檔，完成後才取代原檔。
+    """
+    cell_updates = cell_updates or {}
+    appended_rows = appended_rows or {}
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(path) as zf:
+            sheet_paths = find_sheet_paths(zf)
+            patched = {}
+            for name in set(cell_updates) | set(appended_rows):
+                if name not in sheet_paths:
+                    raise XlsxPatchError(f"找不到工作表: {name}")
+                sheet = SheetXml(zf.read(sheet_paths[name]))
+                for row_index, col_index, value in cell_updates.get(name, ()):
+                    sheet.set_value(row_index, col_index, value)
+                for values in appended_rows.get(name, ()):
+                    sheet.append(values)
+                patched[sheet_paths[name]] = sheet.tobytes()
+
+            # 其他檔案原樣複製，ZipInfo 會保留原本的壓縮方式
+            with zipfile.ZipFile(tmp_path, 'w') as out:
+                for info in zf.infolist():
+                    out.writestr(info, patched.get(info.filename) or zf.read(info))
+        # mkstemp 建立的暫存檔權限為 0600，取代前改回與原檔相同
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise